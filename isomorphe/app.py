@@ -1,6 +1,9 @@
-import io
 import os
-from datetime import datetime
+import shutil
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
 from pathlib import Path
 
 import requests
@@ -16,23 +19,51 @@ from flask import (
     session,
     url_for,
 )
+from flask_session import Session
+from rq.job import JobStatus
 
 from isomorphe.auth import authenticated, connection_infos
 from isomorphe.batch import (
     MigrateMode,
     SkipReasonMessage,
     SuccessTransformBatchRecord,
+    TransformBatch,
     TransformBatchRecord,
 )
 from isomorphe.geonetwork import GeonetworkConnectionError
-from isomorphe.migrator import Migrator
-from isomorphe.rqueue import get_job, get_queue
+from isomorphe.migrator import TRANSFORMATIONS_PATH, Migrator
+from isomorphe.rqueue import get_connection, get_job, get_queue, iter_job_status, put_payload
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET_KEY", "default-secret-key")
 app.config["TRANSFORM_TTL"] = 60 * 60 * 24 * 7 * 30 * 2  # 2 months
 app.config["MIGRATE_TTL"] = 60 * 60 * 24 * 7 * 30 * 2  # 2 months
-app.config["TRANSFORMATIONS_PATH"] = Path(app.root_path, "transformations")
+app.config["PAYLOAD_TTL"] = 60 * 60 * 24  # 1 day, only needed until the job is picked up
+app.config["RECORD_CACHE_TTL"] = 60 * 60  # 1 hour
+app.config["SOURCES_CACHE_TTL"] = 60 * 5  # 5 minutes
+app.config["TRANSFORMATIONS_PATH"] = TRANSFORMATIONS_PATH
+# Job status streams are closed after this long (seconds), clients reconnect after the retry delay
+app.config["JOB_EVENTS_MAX_DURATION"] = 60
+app.config["JOB_EVENTS_RETRY"] = 1
+# Built MEF archives, kept on disk so downloads don't rebuild them from the job result.
+# They can be rebuilt as long as the job exists, so they're kept for a much shorter time.
+app.config["MEF_CACHE_PATH"] = Path(
+    os.getenv("MEF_CACHE_PATH", Path(tempfile.gettempdir()) / "isomorphe-mef")
+)
+app.config["MEF_CACHE_TTL"] = min(60 * 60 * 24, app.config["TRANSFORM_TTL"])  # 1 day
+# Let nginx serve the archives: internal location mapped to MEF_CACHE_PATH, e.g. `/_mef/`
+app.config["MEF_ACCEL_REDIRECT_PREFIX"] = os.getenv("MEF_ACCEL_REDIRECT_PREFIX")
+# Let Apache (mod_xsendfile) or lighttpd serve the archives, nginx ignores X-Sendfile
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "").lower() in ("1", "true")
+# Keep session data in Redis, the cookie only carries the session id
+app.config["SESSION_TYPE"] = "redis"
+app.config["SESSION_REDIS"] = get_connection()
+app.config["SESSION_KEY_PREFIX"] = "isomorphe:session:"
+# Sessions hold the Geonetwork credentials: the cookie expires when the browser is closed,
+# and the session data is removed from Redis after this long (even if the browser stays open)
+app.config["SESSION_PERMANENT"] = False
+app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(hours=12)
+Session(app)
 
 
 @app.route("/")
@@ -120,12 +151,20 @@ def transform():
         if form_param_name not in request.form:
             abort(400, f"Missing `{param.name}` parameter for transformation")
         transformation_params[param.name] = request.form.get(form_param_name)
-    migrator = Migrator(url=url, username=username, password=password)
+    migrator = Migrator(
+        url=url,
+        username=username,
+        password=password,
+        record_cache_ttl=app.config["RECORD_CACHE_TTL"],
+        sources_cache_ttl=app.config["SOURCES_CACHE_TTL"],
+    )
     selection = migrator.select(query=query)
+    # Enqueue a pointer to the selection rather than the (potentially large) selection itself
+    selection_key = put_payload(selection, ttl=app.config["PAYLOAD_TTL"])
     job = get_queue().enqueue(
-        migrator.transform,
+        migrator.transform_by_key,
         transformation,
-        selection,
+        selection_key,
         transformation_params=transformation_params,
         result_ttl=app.config["TRANSFORM_TTL"],
     )
@@ -182,19 +221,99 @@ def transform_job_status(job_id: str):
     )
 
 
+@app.route("/transform/job_events/<job_id>")
+def transform_job_events(job_id: str):
+    """
+    Server-Sent Events stream of the job status, so the page only re-renders the status
+    fragment when the status actually changes.
+    """
+    job = get_job(job_id)
+    if not job:
+        abort(404)
+    # On reconnection, EventSource sends the id of the last event, i.e. the status it rendered
+    try:
+        known_status = JobStatus(request.headers.get("Last-Event-ID", ""))
+    except ValueError:
+        known_status = None
+    deadline = time.monotonic() + app.config["JOB_EVENTS_MAX_DURATION"]
+
+    def events():
+        yield f"retry: {app.config['JOB_EVENTS_RETRY'] * 1000}\n\n"
+        with closing(iter_job_status(job, status=known_status)) as statuses:
+            for status in statuses:
+                if status:
+                    yield f"id: {status.value}\ndata: {status.value}\n\n"
+                elif time.monotonic() > deadline:
+                    # Don't hold a worker thread and a Redis connection for the whole job,
+                    # the client reconnects after `retry` and resumes from its last status
+                    return
+                else:
+                    # comment lines keep the connection alive (and detect closed ones)
+                    yield ": heartbeat\n\n"
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/transform/download_result/<job_id>")
 def transform_download_result(job_id: str):
     job = get_job(job_id)
     if not job:
         abort(404)
+    mef_path = app.config["MEF_CACHE_PATH"] / f"{job_id}.zip"
+    if not is_fresh(mef_path, app.config["MEF_CACHE_TTL"]):
+        write_mef(job.result, mef_path)
+        sweep_mef_cache(app.config["MEF_CACHE_PATH"], app.config["MEF_CACHE_TTL"])
+    if prefix := app.config["MEF_ACCEL_REDIRECT_PREFIX"]:
+        rsp = Response(mimetype="application/zip")
+        rsp.headers["X-Accel-Redirect"] = f"{prefix.rstrip('/')}/{mef_path.name}"
+        rsp.headers.set("Content-Disposition", "attachment", filename=f"{job_id}.zip")
+        return rsp
     return send_file(
-        io.BytesIO(job.result.to_mef()),
+        mef_path,
         mimetype="application/zip",
         download_name=f"{job_id}.zip",
         as_attachment=True,
     )
 
 
+def is_fresh(path: Path, ttl: int) -> bool:
+    try:
+        return time.time() - path.stat().st_mtime < ttl
+    except FileNotFoundError:
+        return False
+
+
+def write_mef(batch: TransformBatch, path: Path):
+    """
+    Build the MEF archive of a transform batch and store it at `path`.
+
+    The archive is written to a temporary file first and moved in place once complete,
+    so that concurrent downloads never serve a partial archive.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".part", delete=False) as f:
+        try:
+            with batch.to_mef() as mef:
+                shutil.copyfileobj(mef, f)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+def sweep_mef_cache(path: Path, ttl: int):
+    """
+    Remove the archives (and leftover partial writes) from `path` older than `ttl` seconds.
+    """
+    for f in path.iterdir():
+        if not is_fresh(f, ttl):
+            f.unlink(missing_ok=True)
+
+
 @app.route("/migrate/<job_id>", methods=["POST"])
 @authenticated()
 def migrate(job_id: str):
@@ -209,13 +328,13 @@ def migrate(job_id: str):
     if not overwrite and not group:
         abort(400, "Missing `group` parameter")
     migrator = Migrator(url=url, username=username, password=password)
+    # The transform result is already stored by RQ, let the worker load it from there
     migrate_job = get_queue().enqueue(
-        migrator.migrate,
-        transform_job.result,
+        migrator.migrate_job_result,
+        job_id,
         overwrite=overwrite,
         group=group,
         result_ttl=app.config["MIGRATE_TTL"],
-        transform_job_id=job_id,
     )
     return redirect(url_for("migrate_success", job_id=migrate_job.id))
 
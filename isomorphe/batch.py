@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from enum import IntEnum, StrEnum
+from typing import IO
 
 from isomorphe.geonetwork import MefArchive, MetadataType, WorkflowState
 
@@ -68,7 +69,7 @@ class TransformBatch:
         return f"TransformBatch({len(self.records)} records, {len(self.failures())} failures, {len(self.successes())} successes, {len(self.skipped())} skipped)"
 
     # FIXME: needed?
-    def to_mef(self):
+    def to_mef(self) -> IO[bytes]:
         mef = MefArchive()
         for r in self.records:
             if isinstance(r, SuccessTransformBatchRecord):
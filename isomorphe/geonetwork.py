@@ -1,18 +1,46 @@
-import io
+import copy
 import logging
 import re
+import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from enum import IntEnum, StrEnum, auto
-from typing import Any
+from typing import IO, Any
 
+import orjson
 import requests
 from lxml import etree
-from lxml.builder import E
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from isomorphe.util import get_xml_parser
 
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
+NAMESPACES = {"gmd": "http://www.isotc211.org/2005/gmd", "geonet": "http://www.fao.org/geonetwork"}
+_RECORD_INFO_XPATH = etree.XPath("/gmd:MD_Metadata/geonet:info", namespaces=NAMESPACES)
+# MEF `info.xml` skeleton, deep-copied and filled in for each record
+_RECORD_INFO_TEMPLATE = etree.fromstring(
+    b'<info version="1.1"><general/><categories/><privileges/><public/><private/></info>'
+)
+# `info.xml` general fields, in MEF order, with the `geonet:info` child they're read from
+# (`None` for values that don't come from the record itself)
+_RECORD_INFO_FIELDS = (
+    ("createDate", "createDate"),
+    ("changeDate", "changeDate"),
+    ("schema", "schema"),
+    ("isTemplate", "isTemplate"),
+    ("localId", "id"),
+    ("format", None),
+    ("rating", "rating"),
+    ("popularity", "popularity"),
+    ("uuid", "uuid"),
+    ("siteId", "source"),
+    ("siteName", None),
+)
+
 
 class MetadataType(StrEnum):
     METADATA = "n"
@@ -66,6 +94,7 @@ class Record:
     title: str
     md_type: MetadataType
     state: WorkflowState | None
+    change_date: str | None = None
 
 
 class GeonetworkConnectionError(Exception):
@@ -73,15 +102,46 @@ class GeonetworkConnectionError(Exception):
 
 
 class GeonetworkClient:
+    MAX_WORKERS = 16
+    MAX_CONNECTIONS = 32
+
     def __init__(self, url, username: str | None = None, password: str | None = None):
         self.url = url
         self.api = f"{self.url}/api"
+        # No need to set Accept-Encoding: requests (urllib3) already sends `gzip, deflate`,
+        # plus `br` when brotli is installed, and transparently decodes responses.
         self.session = requests.Session()
+        # Pool must be larger than MAX_WORKERS so concurrent calls don't discard connections.
+        # Only retry idempotent reads on gateway errors, PUT /records isn't safe to replay.
+        adapter = HTTPAdapter(
+            pool_connections=self.MAX_CONNECTIONS,
+            pool_maxsize=self.MAX_CONNECTIONS,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.2,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=["GET", "HEAD"],
+                raise_on_status=False,  # let raise_for_status() report the last response
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         if username and password:
             self.session.auth = (username, password)
             log.debug(f"Authenticating as: {username}")
+        self._executor = ThreadPoolExecutor(max_workers=self.MAX_WORKERS)
         self.authenticate()
 
+    def __getstate__(self):
+        # The client is pickled along with RQ jobs, executor can't be.
+        state = self.__dict__.copy()
+        del state["_executor"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._executor = ThreadPoolExecutor(max_workers=self.MAX_WORKERS)
+
     def info(self):
         r = self.session.get(f"{self.api}/info?_content_type=json&type=me")
         r.raise_for_status()
@@ -103,6 +163,53 @@ class GeonetworkClient:
     def _get_md_type(self, md: dict) -> MetadataType:
         return MetadataType(md.get("isTemplate", MetadataType.METADATA))
 
+    def _md_to_record(self, md: dict) -> Record:
+        uuid = md["geonet:info"]["uuid"]
+        title = md.get("defaultTitle")
+        md_type = self._get_md_type(md)
+        state = None
+        if "mdStatus" in md:  # workflow enabled
+            if not md.get("draft") == "e":
+                status = WorkflowStatus(int(md["mdStatus"]))
+                stage = (
+                    WorkflowStage.APPROVED
+                    if status == WorkflowStatus.APPROVED
+                    else WorkflowStage.NEVER_APPROVED
+                )
+            else:
+                # Not supported in migration().
+                # We don't bother setting the status (requires an API call), but
+                # still include it in `records` so we can report on it.
+                stage = WorkflowStage.WORKING_COPY
+                status = WorkflowStatus.UNKNOWN
+            state = WorkflowState(stage=stage, status=status)
+            log.debug(f"Workflow state: {state}")
+        rec = Record(
+            uuid=uuid,
+            title=title,
+            md_type=md_type,
+            state=state,
+            change_date=md["geonet:info"].get("changeDate"),
+        )
+        log.debug(f"Record: {rec}")
+        return rec
+
+    def _search(self, params: dict, start: int) -> tuple[dict, list[Record]]:
+        r = self.session.get(
+            f"{self.api}/q",
+            headers={"Accept": "application/json"},
+            params=params | {"from": start},
+        )
+        r.raise_for_status()
+        rsp = orjson.loads(r.content)
+        mds = rsp.get("metadata")
+        if not mds:
+            return rsp, []
+        if "geonet:info" in mds:
+            # When returning a single record, metadata isn't a list :/
+            mds = [mds]
+        return rsp, [self._md_to_record(md) for md in mds]
+
     def get_records(self, query=None) -> list[Record]:
         params = {
             "_content_type": "json",
@@ -114,55 +221,34 @@ class GeonetworkClient:
         if query:
             params |= query
 
-        records = []
-        to = 0
-        while True:
-            r = self.session.get(
-                f"{self.api}/q",
-                headers={"Accept": "application/json"},
-                params=params | {"from": to + 1},
-            )
-            r.raise_for_status()
-            rsp = r.json()
-            mds = rsp.get("metadata")
-            if not mds:
-                break
-            if "geonet:info" in mds:
-                # When returning a single record, metadata isn't a list :/
-                mds = [mds]
-            recs = []
-            for md in mds:
-                uuid = md["geonet:info"]["uuid"]
-                title = md.get("defaultTitle")
-                md_type = self._get_md_type(md)
-                state = None
-                if "mdStatus" in md:  # workflow enabled
-                    if not md.get("draft") == "e":
-                        status = WorkflowStatus(int(md["mdStatus"]))
-                        stage = (
-                            WorkflowStage.APPROVED
-                            if status == WorkflowStatus.APPROVED
-                            else WorkflowStage.NEVER_APPROVED
-                        )
-                    else:
-                        # Not supported in migration().
-                        # We don't bother setting the status (requires an API call), but
-                        # still include it in `records` so we can report on it.
-                        stage = WorkflowStage.WORKING_COPY
-                        status = WorkflowStatus.UNKNOWN
-                    state = WorkflowState(stage=stage, status=status)
-                    log.debug(f"Workflow state: {state}")
-                rec = Record(uuid=uuid, title=title, md_type=md_type, state=state)
-                log.debug(f"Record: {rec}")
-                recs.append(rec)
-            records += recs
+        rsp, records = self._search(params, 1)
+        if not records:
+            return records
+
+        count = rsp.get("summary", {}).get("@count")
+        if count is not None:
+            # Total is known from the first page: fetch the remaining pages concurrently.
+            page_size = int(rsp["@to"]) - int(rsp["@from"]) + 1
+            starts = range(int(rsp["@to"]) + 1, int(count) + 1, page_size)
+            for _, recs in self._executor.map(lambda start: self._search(params, start), starts):
+                records.extend(recs)
+        else:
+            page_size = len(records)
             to = int(rsp.get("@to"))
+            while True:
+                rsp, recs = self._search(params, to + 1)
+                records.extend(recs)
+                # A short page is the last one, no need to request the empty one after it
+                if len(recs) < page_size:
+                    break
+                to = int(rsp.get("@to"))
 
         return records
 
     def get_record(self, uuid: str) -> etree._ElementTree:
         # log.debug(f"Processing record: {record}")
-        r = self.session.get(
+        # Parse the response as it is received instead of buffering it first
+        with self.session.get(
             f"{self.api}/records/{uuid}/formatters/xml",
             headers={"Accept": "application/xml"},
             params={
@@ -172,9 +258,21 @@ class GeonetworkClient:
                 "attachment": "false",
                 "approved": "false",  # only relevant when workflow is enabled
             },
-        )
-        r.raise_for_status()
-        return etree.fromstring(r.content, parser=None)
+            stream=True,
+        ) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            return etree.parse(r.raw, parser=get_xml_parser()).getroot()
+
+    def get_records_xml(self, uuids: list[str]) -> list[etree._ElementTree]:
+        """
+        Fetch several records concurrently.
+
+        :param uuids: UUIDs of the records to fetch.
+        :returns: Records in the same order as `uuids`, as returned by `get_record`.
+            Repeated UUIDs are fetched (and parsed) again, each entry is a distinct tree.
+        """
+        return list(self._executor.map(self.get_record, uuids))
 
     def _extract_uuid_from_put_response(self, payload: dict) -> str | None:
         """
@@ -238,15 +336,22 @@ class GeonetworkClient:
         # metadata as the "edit" outcome.
         log.debug(f"Updating record {uuid}: md_type={md_type.value}, state={state}")
 
-        r = self.session.get(
+        # This GET can't be skipped, even on an already authenticated session: it opens the
+        # editing session of this specific record on the Geonetwork side, which the POST below
+        # then commits and terminates. Its body is useless to us though, so drain it as it
+        # arrives (keeping the connection reusable) instead of buffering the whole editor view.
+        with self.session.get(
             f"{self.api}/records/{uuid}/editor",
             headers={"Accept": "application/xml"},
             params={
                 "currTab": "xml",
                 "withAttributes": "false",  # FIXME: needed? true/false?
             },
-        )
-        r.raise_for_status()
+            stream=True,
+        ) as r:
+            r.raise_for_status()
+            for _ in r.iter_content(chunk_size=64 * 1024):
+                pass
 
         # API expects x-www-form-urlencoded here
         data: dict[str, Any] = {
@@ -291,8 +396,7 @@ class GeonetworkClient:
     def get_sources(self) -> dict:
         r = self.session.get(f"{self.api}/sources", headers={"Accept": "application/json"})
         r.raise_for_status()
-        sources = {s["uuid"]: s["name"] for s in r.json()}
-        return sources
+        return {s["uuid"]: s["name"] for s in orjson.loads(r.content)}
 
     def delete_record(self, uuid: str) -> None:
         log.debug(f"Deleting record: {uuid}")
@@ -336,9 +440,14 @@ class GeonetworkClient:
 
 
 class MefArchive:
-    def __init__(self, compression=zipfile.ZIP_DEFLATED):
-        self.zipb = io.BytesIO()
-        self.zipf = zipfile.ZipFile(self.zipb, "w", compression=compression)
+    # Archives larger than this are spooled to a temporary file on disk
+    MAX_MEMORY_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, compression=zipfile.ZIP_DEFLATED, compresslevel: int | None = 1):
+        self.zipb = tempfile.SpooledTemporaryFile(max_size=self.MAX_MEMORY_SIZE)
+        self.zipf = zipfile.ZipFile(
+            self.zipb, "w", compression=compression, compresslevel=compresslevel
+        )
 
     def add(self, uuid: str, record: bytes, info: str):
         """
@@ -351,12 +460,13 @@ class MefArchive:
         self.zipf.writestr(f"{uuid}/info.xml", info)
         self.zipf.writestr(f"{uuid}/metadata/metadata.xml", record)
 
-    def finalize(self):
+    def finalize(self) -> IO[bytes]:
         """
-        Finalize and return bytes of the full MEF archive.
+        Finalize and return the full MEF archive, as a file object rewound to its start.
         """
         self.zipf.close()
-        return self.zipb.getvalue()
+        self.zipb.seek(0)
+        return self.zipb
 
 
 def extract_record_info(record: etree._ElementTree, sources: dict) -> etree._ElementTree:
@@ -367,27 +477,12 @@ def extract_record_info(record: etree._ElementTree, sources: dict) -> etree._Ele
     :param sources: List of existing sources, as returned by `GeonetworkClient.get_sources`.
     :returns: Record info in MEF `info.xml` format.
     """
-    ri = record.xpath("/gmd:MD_Metadata/geonet:info", namespaces=record.nsmap)[0]
+    ri = _RECORD_INFO_XPATH(record)[0]
     ri.getparent().remove(ri)
-    source_id = ri.find("source").text
-    info = E.info(
-        E.general(
-            E.createDate(ri.find("createDate").text),
-            E.changeDate(ri.find("changeDate").text),
-            E.schema(ri.find("schema").text),
-            E.isTemplate(ri.find("isTemplate").text),
-            E.localId(ri.find("id").text),
-            E.format("simple"),
-            E.rating(ri.find("rating").text),
-            E.popularity(ri.find("popularity").text),
-            E.uuid(ri.find("uuid").text),
-            E.siteId(source_id),
-            E.siteName(sources[source_id]),
-        ),
-        E.categories(),
-        E.privileges(),
-        E.public(),
-        E.private(),
-        version="1.1",
-    )
+    source_id = ri.findtext("source")
+    info = copy.deepcopy(_RECORD_INFO_TEMPLATE)
+    general = info[0]
+    values = {"format": "simple", "siteName": sources[source_id]}
+    for tag, field in _RECORD_INFO_FIELDS:
+        etree.SubElement(general, tag).text = ri.findtext(field) if field else values[tag]
     return info.getroottree()
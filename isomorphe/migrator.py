@@ -1,6 +1,9 @@
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from functools import cached_property
+from itertools import batched
 from pathlib import Path
 
 from lxml import etree
@@ -25,11 +28,25 @@ from isomorphe.geonetwork import (
     WorkflowStage,
     extract_record_info,
 )
-from isomorphe.util import xml_to_string
+from isomorphe.rqueue import (
+    cache_records,
+    cache_sources,
+    get_cached_records,
+    get_cached_sources,
+    get_job,
+    get_payload,
+)
+from isomorphe.util import get_xml_parser, xml_to_string
 
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
+TRANSFORMATIONS_PATH = Path(__file__).parent / "transformations"
+
+# Compiled stylesheets by path, along with the modification time they were compiled from.
+# Populated at worker startup (see `isomorphe.worker`) so forked jobs inherit them.
+_compiled_transforms: dict[Path, tuple[int, etree.XSLT]] = {}
+
 
 @dataclass(kw_only=True)
 class TransformationParam:
@@ -63,17 +80,38 @@ class Transformation:
 
     @property
     def transform(self) -> etree.XSLT:
-        xslt = etree.parse(self.path, parser=None)
+        path = self.path.resolve()
+        mtime = path.stat().st_mtime_ns
+        compiled = _compiled_transforms.get(path)
+        if compiled and compiled[0] == mtime:
+            return compiled[1]
+        log.debug(f"Compiling transformation {self.name}")
+        xslt = etree.parse(path, parser=None)
         transform = etree.XSLT(xslt)
+        _compiled_transforms[path] = (mtime, transform)
         return transform
 
 
 class Migrator:
     def __init__(
-        self, *, url: str, username: str | None = None, password: str | None = None
+        self,
+        *,
+        url: str,
+        username: str | None = None,
+        password: str | None = None,
+        fetch_batch_size: int = 64,
+        record_cache_ttl: int | None = None,
+        sources_cache_ttl: int | None = None,
     ) -> None:
         self.url = url
+        self.username = username
         self.gn = GeonetworkClient(url, username, password)
+        # Number of records fetched concurrently (and held in memory) at once during transform
+        self.fetch_batch_size = fetch_batch_size
+        # Keep fetched records XML in Redis for this long, disabled if None
+        self.record_cache_ttl = record_cache_ttl
+        # Keep the catalog sources in Redis for this long (shared by all jobs), disabled if None
+        self.sources_cache_ttl = sources_cache_ttl
 
     def select(self, **kwargs) -> list[Record]:
         """
@@ -100,77 +138,142 @@ class Migrator:
         Transform data from a selection
         """
         log.debug(f"Transforming {selection} via {transformation}")
-        sources = self.gn.get_sources()
+        sources = self._get_sources()
 
         batch = TransformBatch(transformation=transformation.name)
-        for r in selection:
-            log.debug(f"Processing record {r.uuid}: md_type={r.md_type.name}, state={r.state}")
-            original = self.gn.get_record(r.uuid)
-            batch_record = TransformBatchRecord(
-                url=self.gn.url,
-                uuid=r.uuid,
-                md_type=r.md_type,
-                state=r.state,
-                original=xml_to_string(original),
-            )
-            if r.md_type not in (MetadataType.METADATA, MetadataType.TEMPLATE):
-                batch.add(
-                    SkippedTransformBatchRecord(
-                        **batch_record.__dict__,
-                        reason=SkipReason.UNSUPPORTED_METADATA_TYPE,
-                        info="",
-                    )
-                )
-                continue
-            if r.state and r.state.stage == WorkflowStage.WORKING_COPY:
-                batch.add(
-                    SkippedTransformBatchRecord(
-                        **batch_record.__dict__,
-                        reason=SkipReason.HAS_WORKING_COPY,
-                        info="",
-                    )
-                )
-                continue
-            try:
-                # FIXME: extract_record_info() mutates original
-                info = extract_record_info(original, sources)
-                log.debug(
-                    f"Applying transformation {transformation.name} to {r.uuid} with params {transformation_params}"
-                )
-                transformation_params_quoted = {
-                    k: etree.XSLT.strparam(v)  # type: ignore (stub is wrong for strparam)
-                    for k, v in transformation_params.items()
-                }
-                result = transformation.transform(original, **transformation_params_quoted)
-                result_str = xml_to_string(result)
-                original_str = xml_to_string(original)
-                if result_str != original_str:
-                    batch.add(
-                        SuccessTransformBatchRecord(
-                            **batch_record.__dict__,
-                            result=result_str,
-                            info=xml_to_string(info),
-                        )
-                    )
-                else:
-                    batch.add(
-                        SkippedTransformBatchRecord(
-                            **batch_record.__dict__,
-                            info=xml_to_string(info),
-                            reason=SkipReason.NO_CHANGES,
-                        )
-                    )
-            except Exception as e:
-                batch.add(
-                    FailureTransformBatchRecord(
-                        **batch_record.__dict__,
-                        error=str(e),
-                    )
-                )
+        # libxslt releases the GIL, so threads are enough to apply the transformation in parallel
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for chunk in batched(selection, self.fetch_batch_size):
+                originals = self._get_records_xml(chunk)
+                # map() preserves ordering, records are added in selection order
+                for batch_record in executor.map(
+                    lambda r, original: self._transform_record(
+                        r, original, transformation, sources, transformation_params
+                    ),
+                    chunk,
+                    originals,
+                ):
+                    batch.add(batch_record)
 
         log.debug("Transformation done.")
         return batch
 
+    def transform_by_key(
+        self,
+        transformation: Transformation,
+        selection_key: str,
+        transformation_params: dict[str, str] = {},
+    ) -> TransformBatch:
+        """
+        Transform data from a selection stored with `rqueue.put_payload`
+        """
+        selection = get_payload(selection_key)
+        return self.transform(
+            transformation, selection, transformation_params=transformation_params
+        )
+
+    def _get_sources(self) -> dict:
+        """
+        Get the catalog sources, reusing the ones fetched by a previous job if still fresh.
+        """
+        if not self.sources_cache_ttl:
+            return self.gn.get_sources()
+        sources = get_cached_sources(self.url)
+        if sources is None:
+            sources = self.gn.get_sources()
+            cache_sources(self.url, sources, ttl=self.sources_cache_ttl)
+        return sources
+
+    def _get_records_xml(self, records: list[Record]) -> list[etree._ElementTree]:
+        """
+        Fetch records XML, reusing the ones fetched by previous jobs when the record's change
+        date (as reported by `select`) shows it hasn't been modified since.
+
+        :returns: Records XML in the same order as `records`, one distinct tree per entry
+            (transforming a record mutates its tree, even the same UUID can't share one).
+        """
+        if not self.record_cache_ttl:
+            return self.gn.get_records_xml([r.uuid for r in records])
+
+        # Records are fetched with their `geonet:info`, which holds the permissions of the
+        # account they were fetched with: only share them between jobs of the same account.
+        prefix = f"isomorphe:record:{self.url}:{self.username or ''}"
+        keys = [f"{prefix}:{r.uuid}:{r.change_date}" if r.change_date else None for r in records]
+        cached = get_cached_records([k for k in keys if k])
+        originals = [
+            etree.fromstring(cached[k], parser=get_xml_parser()) if k in cached else None
+            for k in keys
+        ]
+        missing = [i for i, xml in enumerate(originals) if xml is None]
+        log.debug(f"Reusing {len(records) - len(missing)} cached records out of {len(records)}")
+        fetched = self.gn.get_records_xml([records[i].uuid for i in missing])
+        cache_records(
+            {keys[i]: etree.tostring(xml) for i, xml in zip(missing, fetched) if keys[i]},
+            ttl=self.record_cache_ttl,
+        )
+        for i, xml in zip(missing, fetched):
+            originals[i] = xml
+        return originals
+
+    def _transform_record(
+        self,
+        r: Record,
+        original: etree._ElementTree,
+        transformation: Transformation,
+        sources: dict,
+        transformation_params: dict[str, str],
+    ) -> TransformBatchRecord:
+        log.debug(f"Processing record {r.uuid}: md_type={r.md_type.name}, state={r.state}")
+        batch_record = TransformBatchRecord(
+            url=self.gn.url,
+            uuid=r.uuid,
+            md_type=r.md_type,
+            state=r.state,
+            original=xml_to_string(original),
+        )
+        if r.md_type not in (MetadataType.METADATA, MetadataType.TEMPLATE):
+            return SkippedTransformBatchRecord(
+                **batch_record.__dict__,
+                reason=SkipReason.UNSUPPORTED_METADATA_TYPE,
+                info="",
+            )
+        if r.state and r.state.stage == WorkflowStage.WORKING_COPY:
+            return SkippedTransformBatchRecord(
+                **batch_record.__dict__,
+                reason=SkipReason.HAS_WORKING_COPY,
+                info="",
+            )
+        try:
+            # FIXME: extract_record_info() mutates original
+            info = extract_record_info(original, sources)
+            log.debug(
+                f"Applying transformation {transformation.name} to {r.uuid} with params {transformation_params}"
+            )
+            transformation_params_quoted = {
+                k: etree.XSLT.strparam(v)  # type: ignore (stub is wrong for strparam)
+                for k, v in transformation_params.items()
+            }
+            result = transformation.transform(original, **transformation_params_quoted)
+            result_str = xml_to_string(result)
+            original_str = xml_to_string(original)
+            if result_str != original_str:
+                return SuccessTransformBatchRecord(
+                    **batch_record.__dict__,
+                    result=result_str,
+                    info=xml_to_string(info),
+                )
+            else:
+                return SkippedTransformBatchRecord(
+                    **batch_record.__dict__,
+                    info=xml_to_string(info),
+                    reason=SkipReason.NO_CHANGES,
+                )
+        except Exception as e:
+            return FailureTransformBatchRecord(
+                **batch_record.__dict__,
+                error=str(e),
+            )
+
     def migrate(
         self,
         batch: TransformBatch,
@@ -222,6 +325,25 @@ class Migrator:
         log.debug("Migration done.")
         return migrate_batch
 
+    def migrate_job_result(
+        self,
+        transform_job_id: str,
+        overwrite: bool = False,
+        group: int | None = None,
+    ) -> MigrateBatch:
+        """
+        Migrate the batch produced by transform job `transform_job_id`
+        """
+        transform_job = get_job(transform_job_id)
+        if not transform_job:
+            raise ValueError(f"Transform job {transform_job_id} not found")
+        return self.migrate(
+            transform_job.result,
+            overwrite=overwrite,
+            group=group,
+            transform_job_id=transform_job_id,
+        )
+
     @staticmethod
     def list_transformations(root_path: Path) -> list[Transformation]:
         return [Transformation(p) for p in root_path.glob("*.xsl")]
@@ -229,3 +351,11 @@ class Migrator:
     @staticmethod
     def get_transformation(name: str, root_path: Path) -> Transformation:
         return Transformation(root_path / f"{name}.xsl")
+
+    @staticmethod
+    def preload_transformations(root_path: Path) -> None:
+        """
+        Compile all transformations from `root_path` ahead of their first use
+        """
+        for transformation in Migrator.list_transformations(root_path):
+            transformation.transform
@@ -1,15 +1,25 @@
 import os
+import pickle
+from typing import Any, Iterator
+from uuid import uuid4
 
-from redis import Redis
+import orjson
+from redis import ConnectionPool, Redis
 from rq import Queue as RQQueue
 from rq.exceptions import NoSuchJobError
-from rq.job import Job
+from rq.job import Job, JobStatus
 
+_pool = None
 _queue = None
 
+FINAL_JOB_STATUSES = (JobStatus.FINISHED, JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED)
+
 
 def get_connection() -> Redis:
-    return Redis.from_url(os.getenv("REDIS_URL", "redis://"))
+    global _pool
+    if not _pool:
+        _pool = ConnectionPool.from_url(os.getenv("REDIS_URL", "redis://"), max_connections=32)
+    return Redis(connection_pool=_pool)
 
 
 def get_queue() -> RQQueue:
@@ -24,3 +34,90 @@ def get_job(job_id: str) -> Job | None:
         return Job.fetch(job_id, connection=get_connection())
     except NoSuchJobError:
         return None
+
+
+def put_payload(payload: Any, ttl: int) -> str:
+    """
+    Store a (large) job argument in its own Redis key, so that only the key has to be enqueued.
+
+    :param payload: Picklable object to store.
+    :param ttl: Expiration of the stored payload, in seconds.
+    :returns: Key to pass to `get_payload`.
+    """
+    key = f"isomorphe:payload:{uuid4()}"
+    get_connection().set(key, pickle.dumps(payload), ex=ttl)
+    return key
+
+
+def get_payload(key: str) -> Any:
+    data = get_connection().get(key)
+    if data is None:
+        raise KeyError(f"Payload {key} not found (expired?)")
+    return pickle.loads(data)
+
+
+def get_cached_records(keys: list[str]) -> dict[str, bytes]:
+    """
+    :returns: Records XML stored with `cache_records`, by key (missing keys are omitted).
+    """
+    if not keys:
+        return {}
+    values = get_connection().mget(keys)
+    return {k: v for k, v in zip(keys, values) if v is not None}
+
+
+def cache_records(records: dict[str, bytes], ttl: int) -> None:
+    pipeline = get_connection().pipeline(transaction=False)
+    for key, xml in records.items():
+        pipeline.set(key, xml, ex=ttl)
+    pipeline.execute()
+
+
+def get_cached_sources(url: str) -> dict | None:
+    """
+    :returns: Catalog sources stored with `cache_sources`, or None if missing (expired).
+    """
+    data = get_connection().get(f"isomorphe:sources:{url}")
+    return orjson.loads(data) if data is not None else None
+
+
+def cache_sources(url: str, sources: dict, ttl: int) -> None:
+    get_connection().set(f"isomorphe:sources:{url}", orjson.dumps(sources), ex=ttl)
+
+
+def job_events_channel(job_id: str) -> str:
+    return f"rq:job:{job_id}:events"
+
+
+def publish_job_status(connection: Redis, job: Job) -> None:
+    """
+    Notify `iter_job_status` listeners that the status of `job` changed.
+    """
+    connection.publish(job_events_channel(job.id), job.get_status(refresh=True))
+
+
+def iter_job_status(
+    job: Job, status: JobStatus | None = None, heartbeat: int = 15
+) -> Iterator[JobStatus | None]:
+    """
+    Yield the status of `job` each time it changes, until it reaches a final status.
+
+    Wakes up on the notifications sent by `publish_job_status`, and at least every `heartbeat`
+    seconds, in which case it yields `None` if the status didn't change (also covers workers
+    not publishing notifications).
+
+    :param status: Status already known to the caller, only yielded again once it changes.
+    """
+    pubsub = get_connection().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(job_events_channel(job.id))
+    try:
+        while True:
+            # Read the status *after* subscribing, so that no change can be missed
+            new_status = job.get_status(refresh=True)
+            yield new_status if new_status != status else None
+            status = new_status
+            if status in FINAL_JOB_STATUSES:
+                return
+            pubsub.get_message(timeout=heartbeat)
+    finally:
+        pubsub.close()
@@ -1,7 +1,30 @@
+import threading
+
 from lxml import etree
 
 XML_FORMAT = {"encoding": "utf-8", "pretty_print": True, "xml_declaration": True}
 
+_local = threading.local()
+
 
 def xml_to_string(tree: etree._ElementTree, format: dict = XML_FORMAT):
     return etree.tostring(tree, **format)
+
+
+def get_xml_parser() -> etree.XMLParser:
+    """
+    Parser for documents fetched from remote catalogs.
+
+    No DTD loading, entity resolution or network access (faster, and not vulnerable to XXE).
+    lxml parsers can't be used concurrently, so there's one per thread.
+    """
+    parser = getattr(_local, "parser", None)
+    if parser is None:
+        parser = _local.parser = etree.XMLParser(
+            no_network=True,
+            resolve_entities=False,
+            load_dtd=False,
+            collect_ids=False,
+            huge_tree=True,
+        )
+    return parser
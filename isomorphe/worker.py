@@ -0,0 +1,31 @@
+from rq import Worker as RQWorker
+
+from isomorphe.migrator import TRANSFORMATIONS_PATH, Migrator
+from isomorphe.rqueue import publish_job_status
+
+
+class Worker(RQWorker):
+    """
+    RQ worker compiling the transformations once at startup, instead of once per job:
+    the work horses forked for each job inherit the compiled stylesheets.
+
+    It also publishes job status changes, see `rqueue.iter_job_status`.
+
+    Usage: `rq worker --worker-class isomorphe.worker.Worker`
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        Migrator.preload_transformations(TRANSFORMATIONS_PATH)
+
+    def prepare_job_execution(self, job, *args, **kwargs):
+        super().prepare_job_execution(job, *args, **kwargs)
+        publish_job_status(self.connection, job)
+
+    def handle_job_success(self, job, *args, **kwargs):
+        super().handle_job_success(job, *args, **kwargs)
+        publish_job_status(self.connection, job)
+
+    def handle_job_failure(self, job, *args, **kwargs):
+        super().handle_job_failure(job, *args, **kwargs)
+        publish_job_status(self.connection, job)
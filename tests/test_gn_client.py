@@ -1,3 +1,7 @@
+from unittest.mock import Mock, patch
+
+import orjson
+import pytest
 from conftest import Fixture
 
 from isomorphe.geonetwork import (
@@ -35,3 +39,43 @@ def test_records_order(gn_client: GeonetworkClient):
         return info.xpath("//changeDate/text()")[0]
 
     assert records == sorted(records, key=get_change_date_from_record)
+
+
+def paged_search(total: int, page_size: int, with_count: bool):
+    """Fake `GET /q`, serving `total` records `page_size` at a time"""
+    requested = []
+
+    def get(url, params, **kwargs):
+        start = params["from"]
+        requested.append(start)
+        end = min(start + page_size - 1, total)
+        rsp = {"@from": str(start), "@to": str(end)}
+        if with_count:
+            rsp["summary"] = {"@count": str(total)}
+        if start <= end:
+            rsp["metadata"] = [
+                {"geonet:info": {"uuid": f"uuid-{i}", "changeDate": f"{i}"}}
+                for i in range(start, end + 1)
+            ]
+        return Mock(content=orjson.dumps(rsp))
+
+    return get, requested
+
+
+@pytest.mark.parametrize("with_count", [True, False])
+def test_records_pagination(gn_client: GeonetworkClient, with_count: bool):
+    """All pages are fetched in order and the search stops after the last (short) page"""
+    get, requested = paged_search(total=47, page_size=10, with_count=with_count)
+    with patch.object(gn_client.session, "get", get):
+        records = gn_client.get_records()
+    assert [r.uuid for r in records] == [f"uuid-{i}" for i in range(1, 48)]
+    assert sorted(requested) == [1, 11, 21, 31, 41]
+
+
+def test_records_pagination_exact_pages(gn_client: GeonetworkClient):
+    """Without a total count, a full last page is followed by an empty one"""
+    get, requested = paged_search(total=40, page_size=10, with_count=False)
+    with patch.object(gn_client.session, "get", get):
+        records = gn_client.get_records()
+    assert len(records) == 40
+    assert requested == [1, 11, 21, 31, 41]
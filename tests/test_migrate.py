@@ -10,11 +10,9 @@ from isomorphe.migrator import Migrator
 
 
 def get_records(migrator: Migrator, md_fixtures: list[Fixture]) -> dict[str, str]:
-    records = {}
-    for fixture in md_fixtures:
-        record = migrator.gn.get_record(fixture.uuid)
-        records[fixture.uuid] = (etree.tostring(record),)
-    return records
+    uuids = [f.uuid for f in md_fixtures]
+    records = migrator.gn.get_records_xml(uuids)
+    return {uuid: (etree.tostring(record),) for uuid, record in zip(uuids, records)}
 
 
 def test_migrate_change_language_overwrite(migrator: Migrator, md_fixtures: list[Fixture]):
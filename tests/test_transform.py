@@ -2,7 +2,7 @@ from pathlib import Path
 from unittest.mock import patch
 
 import pytest
-from conftest import Fixture
+from conftest import GN_TEST_USER, Fixture
 
 from isomorphe.batch import TransformBatch
 from isomorphe.geonetwork import (
@@ -140,3 +140,62 @@ def test_load_transformation_params():
             required=True,
         ),
     ]
+
+
+def test_transformation_compiled_once():
+    """Stylesheet is compiled once and reused across calls and instances"""
+    transformation = get_transformation("noop")
+    assert transformation.transform is transformation.transform
+    assert get_transformation("noop").transform is transformation.transform
+
+
+def test_transform_record_cache(migrator: Migrator):
+    """Records unchanged since a previous transform are not fetched again"""
+    cache = {}
+    migrator.record_cache_ttl = 60
+    with (
+        patch(
+            "isomorphe.migrator.get_cached_records",
+            lambda keys: {k: cache[k] for k in keys if k in cache},
+        ),
+        patch("isomorphe.migrator.cache_records", lambda records, ttl: cache.update(records)),
+    ):
+        first, selection = get_transform_results("change-language", migrator)
+        assert len(cache) == len(selection)
+        # cached XML holds the account's permissions, it must not be shared with other accounts
+        assert all(f":{GN_TEST_USER}:" in key for key in cache)
+        with patch.object(GeonetworkClient, "get_record") as mocked_method:
+            second, _ = get_transform_results("change-language", migrator, selection=selection)
+        mocked_method.assert_not_called()
+    assert [r.result for r in second.successes()] == [r.result for r in first.successes()]
+
+
+def test_transform_duplicate_records(migrator: Migrator, clean_md_fixtures: list[Fixture]):
+    """A record selected twice is transformed twice, from its own copy of the XML"""
+    selection = migrator.select(query="type=dataset")
+    batch, _ = get_transform_results(
+        "change-language", migrator, selection=[selection[0], selection[0]]
+    )
+    assert len(batch.failures()) == 0
+    assert len(batch.successes()) == 2
+    assert batch.successes()[0].result == batch.successes()[1].result
+
+
+def test_transform_sources_cache(migrator: Migrator):
+    """Catalog sources are fetched once and shared by the following transforms"""
+    cache = {}
+    migrator.sources_cache_ttl = 60
+    with (
+        patch("isomorphe.migrator.get_cached_sources", lambda url: cache.get(url)),
+        patch(
+            "isomorphe.migrator.cache_sources",
+            lambda url, sources, ttl: cache.update({url: sources}),
+        ),
+        patch.object(
+            GeonetworkClient, "get_sources", autospec=True, side_effect=GeonetworkClient.get_sources
+        ) as mocked_method,
+    ):
+        first, selection = get_transform_results("noop", migrator)
+        second, _ = get_transform_results("noop", migrator, selection=selection)
+    mocked_method.assert_called_once()
+    assert [r.info for r in second.skipped()] == [r.info for r in first.skipped()]